@@ -149,7 +149,6 @@ class FST:
 
 
 if __name__ == "__main__":
-    import json
     from fsa import FSA
     from spell_fst import Spell_Checker
 
@@ -158,15 +157,14 @@ if __name__ == "__main__":
         words = f.read().strip().split()
         alphabet = sorted(set("".join(words))) + [""]
 
-    with open("data/spell-errors.json", 'rt', encoding='utf8') as f:
-        errcount = json.loads(f.read())
+    symbols, logprobs = Spell_Checker.load_edit_model(alphabet, "data/spell-errors.json")
 
     fsa = FSA(deterministic=True)
     fsa.build_trie(words)
     # fsa.minimize()
 
     lexicon = FST.fromfsa(fsa)
-    edits = Spell_Checker.build_editfst(alphabet, errcount)
+    edits = Spell_Checker.build_editfst(alphabet, symbols, logprobs)
 
     spellfst = FST.compose_fst(lexicon, edits)
     spellfst.invert()
@@ -3,6 +3,8 @@ from fsa import FSA
 from fst import FST
 import json
 import datetime
+import hashlib
+import os
 
 
 class Spell_Checker:
@@ -10,60 +12,102 @@ class Spell_Checker:
        Implements the pipeline to build a spell-checker
     """
 
-    def __init__(self, lexicon='data/lexicon.txt', spell_errors='data/spell-errors.json'):
+    def __init__(self, lexicon='data/lexicon.txt', spell_errors='data/spell-errors.json', cache_dir='data/cache'):
         self.fst = None
-        self.l, self.se = lexicon, spell_errors
+        self.l, self.se, self.cache = lexicon, spell_errors, cache_dir
         self.build_pipeline()
 
     @staticmethod
-    def build_editfst(alphabet, counts):
+    def count_matrix(alphabet, counts):
+        """
+        Intern the alphabet and load the alignment counts into a square count matrix.
+
+        The interned alphabet is the union of `alphabet` and every symbol seen in `counts`,
+        with the empty string (insertion/deletion) kept last. Pairs missing from `counts`
+        are counted as 0.
+
+        Returns: (symbols, matrix) where matrix[i, j] is how often symbols[i] was aligned to symbols[j].
+        """
+        seen = set(alphabet) | set(counts)
+        for row in counts.values():
+            seen.update(row)
+        seen.discard("")
+        symbols = sorted(seen) + [""]
+        index = {sym: i for i, sym in enumerate(symbols)}
+
+        matrix = np.zeros((len(symbols), len(symbols)))
+        for ch1, row in counts.items():
+            i = index[ch1]
+            for ch2, occ in row.items():
+                matrix[i, index[ch2]] = occ
+        return symbols, matrix
+
+    @staticmethod
+    def edit_logprobs(matrix, smoothing=0.05):
+        """
+        Smoothed log10 probabilities of all edit operations, computed row-wise in one step.
+
+        Row "" holds the insertions, column "" the deletions, the diagonal the identities
+        and everything else the substitutions.
+        """
+        totals = matrix.sum(axis=1, keepdims=True) + matrix.shape[1] * smoothing
+        return np.log10((matrix + smoothing) / totals)
+
+    @staticmethod
+    def load_edit_model(alphabet, spell_errors, cache_dir='data/cache'):
+        """
+        Compiled edit model for `alphabet`, cached on disk.
+
+        The cache file is keyed by the hash of the counts JSON (and the alphabet),
+        so it is rebuilt only when `spell_errors` changes.
+
+        Returns: (symbols, logprobs) as in `count_matrix` and `edit_logprobs`.
+        """
+        with open(spell_errors, 'rb') as f:
+            raw = f.read()
+
+        key = hashlib.sha256(raw + "\0".join(alphabet).encode('utf8')).hexdigest()[:16]
+        path = os.path.join(cache_dir, f'edit-model-{key}.npz')
+        if os.path.exists(path):
+            with np.load(path) as model:
+                return model['symbols'].tolist(), model['logprobs']
+
+        symbols, matrix = Spell_Checker.count_matrix(alphabet, json.loads(raw.decode('utf8')))
+        logprobs = Spell_Checker.edit_logprobs(matrix)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(path, symbols=np.array(symbols), logprobs=logprobs)
+        return symbols, logprobs
+
+    @staticmethod
+    def build_editfst(alphabet, symbols, logprobs):
 
         """
         Weighted FST instance that implements one-edit-distance operations.
 
-        The transition weight is based on the logarithm of the smoothed number of times
-        particular edit operations were observed in the data.
+        The transition weight is the log probability of the edit operation,
+        as compiled by `edit_logprobs`.
 
         Arguments:
         ----
-        alphabet    All letters that we should recognize
-        counts      Alignment counts generated by compute_weights.py
+        alphabet    All letters that we should recognize, "" included
+        symbols     Interned alphabet indexing the rows/columns of `logprobs`
+        logprobs    Smoothed log10 probabilities of aligning symbols[i] to symbols[j]
         """
+        index = {sym: i for i, sym in enumerate(symbols)}
+        idx = [index[sym] for sym in alphabet]
+        weights = logprobs[np.ix_(idx, idx)].tolist()
+
         editfst = FST()
-        for i in range(len(alphabet)):
+        for i, ch1 in enumerate(alphabet):
             # identity mappings
-            occ_identity, occ_total_identity = counts[alphabet[i]][alphabet[i]] + 0.05, sum(
-                counts[alphabet[i]].values()) + (len(counts[alphabet[i]]) * 0.05)
-            p_identity = occ_identity / occ_total_identity
-
-            editfst.add_transition(s1=0, insym=alphabet[i], s2=0, outsym=alphabet[i], w=np.log10(p_identity),
-                                   accepting=False)
-            editfst.add_transition(s1=1, insym=alphabet[i], s2=1, outsym=alphabet[i], w=np.log10(p_identity),
-                                   accepting=True)
-
-            # deletion mappings
-            occ_deletion, occ_total_deletion = counts[alphabet[i]][""] + 0.05, sum(counts[alphabet[i]].values()) + (
-                    len(counts[alphabet[i]]) * 0.05)
-            p_deletion = occ_deletion / occ_total_deletion
-
-            editfst.add_transition(s1=0, insym=alphabet[i], s2=1, outsym="", w=np.log10(p_deletion), accepting=True)
-
-            # insertion mappings
-            occ_insertion, occ_total_insertion = (counts[""][alphabet[i]] + 0.05, sum(counts[""].values()) +
-                                                  (len(counts[""]) * 0.05))
-            p_insertion = occ_insertion / occ_total_insertion
-
-            editfst.add_transition(s1=0, insym="", s2=1, outsym=alphabet[i], w=np.log10(p_insertion), accepting=True)
-            for j in range(len(alphabet)):
-                if i != j:
-                    # substitution mappings
-                    occ_substitution, occ_total_substitution = counts[alphabet[i]][alphabet[j]] + 0.05, sum(
-                        counts[alphabet[i]].values()) + (len(counts[alphabet[i]]) * 0.05)
-                    p_substitution = occ_substitution / occ_total_substitution
-
-                    editfst.add_transition(s1=0, insym=alphabet[i], s2=1, outsym=alphabet[j],
-                                           w=np.log10(p_substitution),
-                                           accepting=True)
+            editfst.add_transition(s1=0, insym=ch1, s2=0, outsym=ch1, w=weights[i][i], accepting=False)
+            editfst.add_transition(s1=1, insym=ch1, s2=1, outsym=ch1, w=weights[i][i], accepting=True)
+
+            # deletion (j = ""), insertion (i = "") and substitution mappings
+            for j, ch2 in enumerate(alphabet):
+                if i != j or ch1 == "":
+                    editfst.add_transition(s1=0, insym=ch1, s2=1, outsym=ch2, w=weights[i][j], accepting=True)
         return editfst
 
     def build_pipeline(self):
@@ -73,8 +117,7 @@ class Spell_Checker:
             alphabet = sorted(set("".join(words))) + [""]
 
         # common spelling errors, from min. edit-distance alignment
-        with open(self.se, 'rt', encoding='utf8') as f:
-            errcount = json.loads(f.read())
+        symbols, logprobs = Spell_Checker.load_edit_model(alphabet, self.se, self.cache)
 
         # trie lexicon
         print('built fsa lexicon!')
@@ -102,7 +145,7 @@ class Spell_Checker:
 
         # build the edit-distance FST
         print('build misspellings transducer!')
-        edits = Spell_Checker.build_editfst(alphabet, errcount)
+        edits = Spell_Checker.build_editfst(alphabet, symbols, logprobs)
         print('M2 is ready...\n%%%')
 
         # compose FSTs, generates all spelling mistakes